@@ -7,12 +7,20 @@ and recommendations.
 """
 
 import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
 from openai import OpenAI
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
+# Products per category sent to the model (see format_products_for_analysis)
+MAX_PRODUCTS_PER_CATEGORY = 10
+
+# Upper bound on concurrent GPT requests for one chunked analysis
+MAX_PARALLEL_REQUESTS = 4
+
 
 def get_openai_client():
     """Get OpenAI client with API key."""
@@ -32,7 +40,7 @@ def format_products_for_analysis(opportunities: dict, source_market: str, target
             
         lines.append(f"\n## Category: {category}")
         
-        for i, opp in enumerate(opps[:10], 1):  # Limit to top 10 per category
+        for i, opp in enumerate(opps[:MAX_PRODUCTS_PER_CATEGORY], 1):
             jp = opp['jp_product']
             
             lines.append(f"\n### Product {i}: {jp.get('name', 'Unknown')[:100]}")
@@ -50,28 +58,88 @@ def format_products_for_analysis(opportunities: dict, source_market: str, target
     return "\n".join(lines)
 
 
+def chunk_opportunities(opportunities: dict, chunk_size: int) -> list[dict]:
+    """
+    Split opportunities into dicts of at most chunk_size products each.
+    
+    Only the products format_products_for_analysis would send are kept,
+    and category order is preserved across chunks.
+    """
+    chunks = []
+    current = {}
+    count = 0
+    
+    for category, opps in opportunities.items():
+        for opp in opps[:MAX_PRODUCTS_PER_CATEGORY]:
+            if count == chunk_size:
+                chunks.append(current)
+                current = {}
+                count = 0
+            current.setdefault(category, []).append(opp)
+            count += 1
+    
+    if current:
+        chunks.append(current)
+    return chunks
+
+
 def analyze_opportunities(
     opportunities: dict,
     source_market: str,
     target_market: str,
     source_country: str = "Japan",
-    target_country: str = "USA"
+    target_country: str = "USA",
+    chunk_size: Optional[int] = None
 ) -> str:
     """
     Analyze product opportunities using GPT-4 and provide professional insights.
     
+    By default all products go into one request and one report. Passing
+    chunk_size splits them into chunks that are analyzed concurrently; the
+    reports are returned as separate, numbered parts.
+    
     Args:
         opportunities: Dict of category -> opportunity list
         source_market: Source market code (e.g., 'jp')
         target_market: Target market code (e.g., 'us')
         source_country: Full country name for source
         target_country: Full country name for target
+        chunk_size: Max products per GPT request (None: single request)
     
     Returns:
         AI-generated analysis text in markdown format
     """
     client = get_openai_client()
+    chunks = chunk_opportunities(opportunities, chunk_size) if chunk_size else []
+    
+    if len(chunks) <= 1:
+        return _analyze_chunk(
+            client, opportunities, source_market, target_market, source_country, target_country
+        )
     
+    # Network-bound requests: threads overlap them (the OpenAI client is thread-safe)
+    with ThreadPoolExecutor(max_workers=min(MAX_PARALLEL_REQUESTS, len(chunks))) as executor:
+        parts = list(executor.map(
+            lambda chunk: _analyze_chunk(
+                client, chunk, source_market, target_market, source_country, target_country
+            ),
+            chunks
+        ))
+    
+    return "\n\n---\n\n".join(
+        f"# Часть {i}/{len(parts)}\n\n{part}" for i, part in enumerate(parts, 1)
+    )
+
+
+def _analyze_chunk(
+    client: OpenAI,
+    opportunities: dict,
+    source_market: str,
+    target_market: str,
+    source_country: str,
+    target_country: str
+) -> str:
+    """Run one GPT analysis request over the given opportunities."""
     # Format products for analysis
     products_text = format_products_for_analysis(opportunities, source_market, target_market)
     
@@ -7,9 +7,18 @@ from different marketplaces (US, Japan) using the Apify platform.
 
 import os
 import json
-from typing import Optional
+import glob
+import hashlib
+import tempfile
+import threading
+import time
+from functools import lru_cache
+from typing import Optional, TYPE_CHECKING
+from urllib.parse import urlparse
 from dotenv import load_dotenv
-from apify_client import ApifyClient
+
+if TYPE_CHECKING:
+    from apify_client import ApifyClient
 
 # Load environment variables
 load_dotenv()
@@ -17,6 +26,16 @@ load_dotenv()
 # Apify Actor ID for Amazon Bestsellers Scraper
 ACTOR_ID = "junglee/amazon-bestsellers"
 
+# On-disk scrape cache (survives app restarts); see scrape_bestsellers_cached
+SCRAPE_CACHE_DIR = os.path.join(os.path.dirname(__file__), '..', '.tmp', 'scrape_cache')
+SCRAPE_CACHE_TTL = 3600  # seconds
+
+# Max concurrent Apify runs per marketplace, so a wide fan-out can't get one
+# Amazon host rate limited; see _host_slot
+SCRAPES_PER_HOST = 4
+_host_slots: dict[str, threading.BoundedSemaphore] = {}
+_host_slots_lock = threading.Lock()
+
 # Market configurations
 MARKETS = {
     "us": {
@@ -135,15 +154,41 @@ DEFAULT_CATEGORIES = {
 }
 
 
-def get_client() -> ApifyClient:
-    """Initialize and return Apify client."""
+def get_client() -> "ApifyClient":
+    """Return the shared Apify client for the configured token."""
     token = os.getenv("APIFY_API_TOKEN")
     if not token:
         raise ValueError("APIFY_API_TOKEN not found in environment variables. "
                         "Please add it to your .env file.")
+    return _client_for_token(token)
+
+
+@lru_cache(maxsize=None)
+def _client_for_token(token: str) -> "ApifyClient":
+    """
+    Build one ApifyClient per token and reuse it.
+    
+    The client owns its HTTP connection pool, so sharing it lets parallel
+    scrapes reuse keep-alive connections instead of each call opening its own.
+    """
+    # Imported here so importing MARKETS/CATEGORY_URLS stays cheap
+    from apify_client import ApifyClient
     return ApifyClient(token)
 
 
+def prewarm_client() -> None:
+    """
+    Open the shared client's connection to the Apify API ahead of the first scrape.
+    
+    Scrapes never talk to Amazon hosts directly, so the only handshake worth
+    paying early is DNS + TLS to api.apify.com. Failures are only logged.
+    """
+    try:
+        get_client().actor(ACTOR_ID).get()
+    except Exception as e:
+        print(f"⚠️ Apify prewarm skipped: {e}")
+
+
 def scrape_bestsellers(
     category_url: str,
     max_results: int = 20,
@@ -201,6 +246,75 @@ def scrape_bestsellers(
     return items
 
 
+def _host_slot(url: str) -> threading.BoundedSemaphore:
+    """Return the process-wide semaphore for the URL's marketplace host."""
+    host = urlparse(url).netloc
+    with _host_slots_lock:
+        slot = _host_slots.get(host)
+        if slot is None:
+            slot = _host_slots[host] = threading.BoundedSemaphore(SCRAPES_PER_HOST)
+    return slot
+
+
+def scrape_bestsellers_cached(
+    category_url: str,
+    max_results: int = 20,
+    subcategories: int = 1,
+    language: str = "en",
+    max_age: float = SCRAPE_CACHE_TTL
+) -> list[dict]:
+    """
+    scrape_bestsellers with a JSON file cache under .tmp/scrape_cache.
+    
+    Results younger than max_age seconds are loaded from disk instead of
+    starting a new Apify run. Failed or empty scrapes are not cached.
+    """
+    key = json.dumps([category_url, max_results, max(1, subcategories), language])
+    filepath = os.path.join(
+        SCRAPE_CACHE_DIR, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.json'
+    )
+    
+    try:
+        if time.time() - os.path.getmtime(filepath) < max_age:
+            return load_results(filepath)
+    except (OSError, ValueError):
+        pass  # Missing, unreadable or half-written entry: scrape again
+    
+    # Only real Apify runs take a slot; cache hits above never wait
+    with _host_slot(category_url):
+        items = scrape_bestsellers(
+            category_url,
+            max_results=max_results,
+            subcategories=subcategories,
+            language=language
+        )
+    if not items:
+        return items  # Likely a transient Apify hiccup: retry next time
+    
+    # Write to a temp file and rename so readers never see a partial entry
+    os.makedirs(SCRAPE_CACHE_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=SCRAPE_CACHE_DIR, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(items, f, ensure_ascii=False)
+        os.replace(tmp_path, filepath)
+    except OSError as e:
+        print(f"⚠️ Could not write scrape cache: {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    
+    return items
+
+
+def clear_scrape_cache() -> None:
+    """Delete all on-disk scrape cache entries."""
+    for filepath in glob.glob(os.path.join(SCRAPE_CACHE_DIR, '*.json')):
+        try:
+            os.remove(filepath)
+        except OSError:
+            pass
+
+
 def scrape_market(
     market: str,
     categories: list[str] = None,
@@ -7,7 +7,7 @@ to identify product opportunities (items popular in JP but not in US).
 
 import json
 import re
-from typing import Optional
+from typing import Optional, Union
 from difflib import SequenceMatcher
 
 # Currency conversion rates to USD (approximate, updated periodically)
@@ -495,39 +495,59 @@ def compare_markets(
 # EXPORT
 # ============================================================================
 
-def opportunities_to_csv_rows(opportunities: dict[str, list[dict]]) -> list[dict]:
-    """Convert opportunities to flat CSV-ready rows."""
-    rows = []
+# Columns produced by opportunities_to_csv_rows, in export order
+CSV_COLUMNS = [
+    'category', 'opportunity_score', 'reason',
+    'jp_name', 'jp_asin', 'jp_price', 'jp_stars', 'jp_reviews', 'jp_position',
+    'jp_url', 'jp_thumbnail',
+    'us_match_name', 'us_match_reviews', 'similarity_score',
+]
+
+
+def opportunities_to_csv_rows(
+    opportunities: dict[str, list[dict]],
+    as_columns: bool = False
+) -> Union[list[dict], dict[str, list]]:
+    """
+    Convert opportunities to flat CSV-ready rows.
     
-    for category, opps in opportunities.items():
-        for opp in opps:
-            jp = opp['jp_product']
-            us = opp.get('us_match') or {}
-            
-            # Convert price to USD
-            price_val = jp.get('price', {}).get('value', 0)
-            price_currency = jp.get('price', {}).get('currency', '$')
-            price_usd = convert_to_usd(float(price_val) if price_val else 0, price_currency)
-            
-            row = {
-                'category': category,
-                'opportunity_score': opp['opportunity_score'],
-                'reason': opp['reason'],
-                'jp_name': jp.get('name', ''),
-                'jp_asin': jp.get('asin', ''),
-                'jp_price': f"${price_usd:.2f}",  # Always show in USD
-                'jp_stars': jp.get('stars', ''),
-                'jp_reviews': jp.get('reviewsCount', ''),
-                'jp_position': jp.get('position', ''),
-                'jp_url': jp.get('url', ''),
-                'jp_thumbnail': jp.get('thumbnailUrl', ''),
-                'us_match_name': us.get('name', ''),
-                'us_match_reviews': us.get('reviewsCount', ''),
-                'similarity_score': opp.get('similarity_score', 0),
-            }
-            rows.append(row)
+    With as_columns=True, returns {column: values} in CSV_COLUMNS order
+    instead, which a DataFrame takes without a per-row transpose.
+    """
+    pairs = [(category, opp) for category, opps in opportunities.items() for opp in opps]
+    jps = [opp['jp_product'] for _, opp in pairs]
+    uss = [opp.get('us_match') or {} for _, opp in pairs]
+    
+    # One comprehension per column, in CSV_COLUMNS order
+    columns = {
+        'category': [category for category, _ in pairs],
+        'opportunity_score': [opp['opportunity_score'] for _, opp in pairs],
+        'reason': [opp['reason'] for _, opp in pairs],
+        'jp_name': [jp.get('name', '') for jp in jps],
+        'jp_asin': [jp.get('asin', '') for jp in jps],
+        'jp_price': [_usd_price_label(jp) for jp in jps],  # Always show in USD
+        'jp_stars': [jp.get('stars', '') for jp in jps],
+        'jp_reviews': [jp.get('reviewsCount', '') for jp in jps],
+        'jp_position': [jp.get('position', '') for jp in jps],
+        'jp_url': [jp.get('url', '') for jp in jps],
+        'jp_thumbnail': [jp.get('thumbnailUrl', '') for jp in jps],
+        'us_match_name': [us.get('name', '') for us in uss],
+        'us_match_reviews': [us.get('reviewsCount', '') for us in uss],
+        'similarity_score': [opp.get('similarity_score', 0) for _, opp in pairs],
+    }
+    
+    if as_columns:
+        return columns
     
-    return rows
+    return [dict(zip(CSV_COLUMNS, values)) for values in zip(*columns.values())]
+
+
+def _usd_price_label(product: dict) -> str:
+    """Format a product's price converted to USD, e.g. '$12.50'."""
+    price_val = product.get('price', {}).get('value', 0)
+    price_currency = product.get('price', {}).get('currency', '$')
+    price_usd = convert_to_usd(float(price_val) if price_val else 0, price_currency)
+    return f"${price_usd:.2f}"
 
 
 if __name__ == "__main__":
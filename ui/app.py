@@ -7,8 +7,21 @@ Web interface for comparing Amazon bestsellers across different markets.
 import streamlit as st
 import sys
 import os
-import pandas as pd
+import heapq
+import html
+import importlib
+import json
+import logging
+import re
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
+from functools import lru_cache
+from itertools import chain
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 
 # Add parent directory to path for imports
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'execution'))
@@ -16,7 +29,10 @@ sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'execution'))
 from amazon_scraper import (
     MARKETS,
     CATEGORY_URLS,
-    scrape_bestsellers,
+    scrape_bestsellers_cached,
+    clear_scrape_cache,
+    prewarm_client,
+    SCRAPE_CACHE_TTL,
     scrape_market,
     test_connection
 )
@@ -24,13 +40,295 @@ from product_comparator import (
     compare_markets,
     opportunities_to_csv_rows
 )
-from ai_analyzer import analyze_opportunities, format_products_for_analysis
 
-# Cached scraping function (cache for 1 hour to avoid repeated API calls)
-@st.cache_data(ttl=3600, show_spinner=False)
-def cached_scrape_bestsellers(url: str, max_results: int, subcategories: int):
+
+# Lazy module stand-in. importlib.util.LazyLoader isn't usable here: its modules
+# must sit in sys.modules, where Streamlit's inspect.getmodule() scans load them.
+class _LazyModule:
+    """Stand-in that imports the named module on first attribute access."""
+    
+    def __init__(self, name: str):
+        self._name = name
+    
+    def __getattr__(self, attr):
+        return getattr(importlib.import_module(self._name), attr)
+
+
+# Heavy optional modules (openai pulls in httpx/pydantic; universal_adapter pulls
+# in firecrawl) load only when the chat or universal source is actually used
+openai = _LazyModule('openai')
+universal_adapter = _LazyModule('universal_adapter')
+
+logger = logging.getLogger(__name__)
+
+# Set APP_DEBUG=1 to show pipeline trace messages and tracebacks in the UI
+DEBUG = os.getenv("APP_DEBUG") == "1"
+
+# Fragments rerun only their own block: st.fragment from Streamlit 1.37,
+# st.experimental_fragment on 1.33-1.36; older versions render inline
+fragment = getattr(st, 'fragment', None) or getattr(st, 'experimental_fragment', lambda func: func)
+
+# Streamlit 1.52+ accepts a callable for download_button data and only runs it on
+# click; older versions reject callables and need the bytes up front
+DEFERRED_DOWNLOADS = tuple(int(part) for part in st.__version__.split('.')[:2]) >= (1, 52)
+
+# Display labels, built once per process instead of on every rerun
+MARKET_OPTIONS = {
+    code: f"{info['flag']} {info['name']}"
+    for code, info in MARKETS.items()
+}
+
+# Source market picker also offers the Firecrawl-backed universal agent
+MARKET_OPTIONS_WITH_UNIV = {**MARKET_OPTIONS, 'universal': "🌐 Custom Site (AI Agent)"}
+
+CATEGORY_NAMES = {
+    "home-garden": "🏠 Home & Kitchen",
+    "pet-supplies": "🐾 Pet Supplies",
+    "office-products": "📎 Office Products",
+    "sports-outdoors": "⚽ Sports & Outdoors",
+    "toys-games": "🎮 Toys & Games",
+    "adult": "🔞 Adult (18+)"
+}
+
+# Display names for opportunities_to_csv_rows columns; others keep their CSV name
+DISPLAY_COLUMN_NAMES = {
+    'category': 'Category',
+    'opportunity_score': 'Score',
+    'jp_name': 'Product Name',
+    'jp_reviews': 'Reviews',
+    'jp_stars': 'Rating',
+    'jp_price': 'Price',
+    'jp_url': 'URL',
+    'jp_thumbnail': 'Thumbnail',
+    'reason': 'Reason'
+}
+
+# Minimum seconds between progress widget updates while futures complete
+PROGRESS_MIN_INTERVAL = 0.25
+
+# Default rows shipped to st.dataframe (already sorted by score)
+MAX_TABLE_ROWS = 500
+
+# Product Search switches to a vectorized name filter from this many products
+VECTORIZE_MIN_PRODUCTS = 32
+
+# Chat token budgets, estimated from text length (no tokenizer dependency).
+# ~3 chars per token is conservative for the mixed English/Cyrillic text here.
+CHARS_PER_TOKEN = 3
+CHAT_CONTEXT_TOKENS = 2000  # products context + prior analysis in the system prompt
+CHAT_TOKEN_BUDGET = 6000    # system prompt + chat history per request
+
+# System prompt for the results chat; filled per turn with str.format
+CHAT_SYSTEM_PROMPT = """Ты эксперт по Amazon FBA и арбитражу. 
+У тебя есть данные о продуктах и предыдущий анализ.
+
+КОНТЕКСТ ПРОДУКТОВ:
+{products_context}
+
+ПРЕДЫДУЩИЙ АНАЛИЗ:
+{ai_analysis}
+
+Отвечай на русском языке. Будь конкретным, ссылайся на реальные продукты из данных.
+Если спрашивают о конкретном продукте — дай детальный анализ с расчётами."""
+
+# Cached scraping function. The disk cache is the only tier: it checks each
+# entry's age against max_age on every call, which a memory tier with its own
+# TTL could not, and reading a bestseller list back from JSON is cheap.
+def cached_scrape_bestsellers(url: str, max_results: int, subcategories: int, max_age: int = SCRAPE_CACHE_TTL):
     """Cached wrapper for scrape_bestsellers to avoid repeated API calls."""
-    return scrape_bestsellers(url, max_results=max_results, subcategories=subcategories)
+    return scrape_bestsellers_cached(
+        url, max_results=max_results, subcategories=subcategories, max_age=max_age
+    )
+
+
+# One process-wide pool for scrape fan-out: threads are reused across reruns and
+# sessions, and max_workers doubles as a global cap on concurrent Apify runs.
+# Scrapes are network-bound, so threads overlap the waits.
+@st.cache_resource
+def get_scrape_pool() -> ThreadPoolExecutor:
+    """Return the shared scrape thread pool."""
+    return ThreadPoolExecutor(max_workers=16, thread_name_prefix='scrape')
+
+
+# Warm the shared Apify client's connection once per process, off the script thread,
+# so the first analysis doesn't pay the DNS + TLS handshake
+@st.cache_resource(show_spinner=False)
+def start_apify_prewarm() -> threading.Thread:
+    """Start (once) a background thread that prewarms the Apify connection."""
+    thread = threading.Thread(target=prewarm_client, name='apify-prewarm', daemon=True)
+    thread.start()
+    return thread
+
+
+# One OpenAI client per process so chat turns reuse its HTTP connection pool
+@st.cache_resource(show_spinner=False)
+def get_openai_client():
+    """Return a shared OpenAI client (key from Streamlit secrets, then env)."""
+    api_key = None
+    try:
+        if "OPENAI_API_KEY" in st.secrets:
+            api_key = st.secrets["OPENAI_API_KEY"]
+    except Exception:
+        pass
+    if not api_key:
+        api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        raise ValueError("OpenAI API key not found")
+    return openai.OpenAI(api_key=api_key)
+
+
+def chat_token_stream(response):
+    """Yield the text deltas of a streamed chat completion."""
+    for chunk in response:
+        if chunk.choices:
+            yield chunk.choices[0].delta.content or ""
+
+
+def debug_note(message: str, render=None):
+    """Log a pipeline trace message; also show it in the UI when DEBUG is on."""
+    logger.debug(message)
+    if DEBUG:
+        (render or st.info)(f"🔧 DEBUG: {message}")
+
+
+def debug_traceback(message: str):
+    """Log the active exception; also show its traceback in the UI when DEBUG is on."""
+    logger.debug(message, exc_info=True)
+    if DEBUG:
+        import traceback
+        st.code(traceback.format_exc())
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count for budgeting chat requests."""
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def fit_chat_context(products_context: str, ai_analysis: str) -> tuple[str, str]:
+    """Trim products context and prior analysis to share CHAT_CONTEXT_TOKENS.
+    
+    Each side gets at least half the budget; the products context also takes
+    whatever the analysis leaves unused.
+    """
+    budget = CHAT_CONTEXT_TOKENS * CHARS_PER_TOKEN
+    products_context = products_context[:max(budget - len(ai_analysis), budget // 2)]
+    return products_context, ai_analysis[:budget - len(products_context)]
+
+
+def trim_chat_history(messages: list[dict], budget: int) -> list[dict]:
+    """Return the newest messages (role/content only) that fit in budget tokens.
+    
+    The latest message is always kept.
+    """
+    kept = []
+    used = 0
+    for msg in reversed(messages):
+        tokens = estimate_tokens(msg['content'])
+        if kept and used + tokens > budget:
+            break
+        kept.append({"role": msg["role"], "content": msg["content"]})
+        used += tokens
+    kept.reverse()
+    return kept
+
+
+# pandas is only needed once results exist, so keep it off the cold-start path
+@lru_cache(maxsize=1)
+def _pd():
+    """Import pandas on first use."""
+    import pandas as pd
+    return pd
+
+
+def dedupe_products(products: list[dict]) -> list[dict]:
+    """Drop repeats of the same product (subcategory lists overlap), keeping first seen."""
+    seen = set()
+    unique = []
+    for p in products:
+        key = p.get('url') or p.get('asin') or p.get('name')
+        if key and key not in seen:
+            seen.add(key)
+            unique.append(p)
+    return unique
+
+
+def filter_by_name(products: list[dict], query: str) -> list[dict]:
+    """Return products whose name contains query (case-insensitive)."""
+    # Short lists aren't worth the pandas setup cost
+    if len(products) < VECTORIZE_MIN_PRODUCTS:
+        q = query.lower()
+        return [p for p in products if q in p.get('name', '').lower()]
+    
+    names = _pd().Series([p.get('name', '') for p in products], dtype='string')
+    mask = names.str.contains(query, case=False, regex=False, na=False)
+    return [products[i] for i in mask.to_numpy(dtype=bool).nonzero()[0]]
+
+
+def analysis_fingerprint(opportunities: dict) -> int:
+    """Stable id for an opportunities dict, used to key the display cache."""
+    return hash(json.dumps(opportunities, sort_keys=True, default=str))
+
+
+# Display artifacts are cached per result set so widget-triggered reruns skip the pandas work.
+# The columns argument is underscored so Streamlit hashes only the id. These caches are
+# shared by all sessions, so each keeps only the most recent result sets.
+DISPLAY_CACHE_ENTRIES = 32
+
+
+@st.cache_data(show_spinner=False, max_entries=DISPLAY_CACHE_ENTRIES)
+def prepare_display(analysis_id: int, _columns: dict[str, list]):
+    """Build the sorted results DataFrame.
+    
+    _columns is opportunities_to_csv_rows(..., as_columns=True) output; display
+    names are applied to its keys so the frame is built already renamed.
+    """
+    pd = _pd()
+    df = pd.DataFrame({
+        DISPLAY_COLUMN_NAMES.get(name, name): values
+        for name, values in _columns.items()
+    })
+    
+    # Numeric columns can hold '' for missing values; coerce and downcast once
+    df['Score'] = df['Score'].astype('float32')
+    df['Reviews'] = pd.to_numeric(
+        pd.to_numeric(df['Reviews'], errors='coerce').fillna(0), downcast='unsigned'
+    )
+    # A handful of distinct values: dictionary-encoded in the Arrow payload
+    df['Category'] = df['Category'].astype('category')
+    
+    return df.sort_values('Score', ascending=False, kind='stable', ignore_index=True)
+
+
+# Top picks come straight from the opportunities dict (heap selection, no DataFrame)
+# so the cards can render before the full table is built.
+@st.cache_data(show_spinner=False, max_entries=DISPLAY_CACHE_ENTRIES)
+def top_picks(analysis_id: int, _opportunities: dict, n: int = 5) -> list[dict]:
+    """Return the n highest-scoring opportunities as display-named records."""
+    best = heapq.nlargest(
+        n,
+        chain.from_iterable(_opportunities.values()),
+        key=lambda opp: opp['opportunity_score']
+    )
+    # Flatten just these few with the CSV helper so price/field handling matches the table
+    return [
+        {DISPLAY_COLUMN_NAMES.get(name, name): value for name, value in row.items()}
+        for row in opportunities_to_csv_rows({'': best})
+    ]
+
+
+# CSV export is built on demand (see DEFERRED_DOWNLOADS) and cached like the display.
+# It uses the raw columns, not the display frame, so missing values stay blank and
+# scores keep their original precision.
+@st.cache_data(show_spinner=False, max_entries=DISPLAY_CACHE_ENTRIES)
+def results_csv(analysis_id: int, _columns: dict[str, list]) -> bytes:
+    """Encode flattened results (display column names, sorted by score) as CSV bytes."""
+    df = _pd().DataFrame({
+        DISPLAY_COLUMN_NAMES.get(name, name): values
+        for name, values in _columns.items()
+    })
+    df = df.sort_values('Score', ascending=False, kind='stable')
+    return df.to_csv(index=False).encode('utf-8')
+
 
 # Page config
 st.set_page_config(
@@ -39,207 +337,126 @@ st.set_page_config(
     layout="wide"
 )
 
-# Custom CSS
-st.markdown("""
-<style>
-    @import url('https://fonts.googleapis.com/css2?family=Inter:wght@300;400;500;600&display=swap');
+# Custom CSS lives in ui/style.css; the cached read skips disk I/O on reruns
+CSS_PATH = os.path.join(os.path.dirname(__file__), 'style.css')
 
-    /* Global Settings */
-    html, body, [class*="css"] {
-        font-family: 'Inter', sans-serif !important;
-        color: #e0e0e0;
-    }
-    
-    /* Main Background */
-    .stApp {
-        background-color: #0e1117; /* Standard clean dark background */
-        background-image: none;
-    }
-    
-    /* Sidebar */
-    section[data-testid="stSidebar"] {
-        background-color: #161b22;
-        border-right: 1px solid #30363d;
-        box-shadow: none;
-    }
-    
-    /* Headings - Clean White */
-    h1, h2, h3 {
-        font-weight: 600 !important;
-        color: #ffffff !important;
-        background: none;
-        -webkit-text-fill-color: initial;
-        letter-spacing: -0.5px;
-        text-transform: none;
-        text-shadow: none;
-    }
-    
-    /* Paragraphs */
-    p, .stMarkdown {
-        color: #a0a0a0;
-        font-size: 1rem;
-        font-weight: 400;
-    }
 
-    /* Buttons - Minimalist White/Grey */
-    .stButton button {
-        background-color: #f0f0f0;
-        color: #0e1117;
-        border: 1px solid #f0f0f0;
-        border-radius: 6px;
-        padding: 0.5rem 1rem;
-        font-weight: 500;
-        text-transform: none;
-        letter-spacing: normal;
-        box-shadow: none;
-        transition: background-color 0.2s;
-        clip-path: none;
-    }
-    .stButton button:hover {
-        background-color: #ffffff;
-        border-color: #ffffff;
-        transform: none;
-        box-shadow: 0 2px 4px rgba(0,0,0,0.1);
-    }
-    .stButton button:active {
-        background-color: #e0e0e0;
-    }
-    .stButton button:disabled {
-        background-color: #2b313a;
-        border-color: #2b313a;
-        color: #6e7681;
-    }
+@st.cache_data(show_spinner=False)
+def load_css() -> str:
+    """Return the app's custom stylesheet wrapped in a <style> block."""
+    with open(CSS_PATH, 'r', encoding='utf-8') as f:
+        return f"<style>\n{f.read()}</style>"
 
-    /* Inputs - Clean Dark */
-    .stTextInput input, .stSelectbox div[data-baseweb="select"] {
-        background-color: #0d1117;
-        color: #c9d1d9;
-        border: 1px solid #30363d;
-        border-radius: 6px;
-        font-family: 'Inter', sans-serif;
-    }
-    .stTextInput input:focus, .stSelectbox div[data-baseweb="select"]:focus-within {
-        border-color: #58a6ff;
-        box-shadow: none;
-    }
-    
-    /* Checkboxes */
-    .stCheckbox label span[role="checkbox"][aria-checked="true"] {
-        background-color: #58a6ff !important;
-        border-color: #58a6ff !important;
-    }
 
-    /* Cards / Metrics */
-    div[data-testid="stMetric"] {
-        background-color: #161b22;
-        border: 1px solid #30363d;
-        border-radius: 6px;
-        padding: 1rem;
-        border-left: none; /* Removed colored accents */
-    }
-    div[data-testid="stMetricLabel"] {
-        color: #8b949e;
-        font-weight: 400;
-        text-transform: none;
-        font-size: 0.875rem;
-    }
-    div[data-testid="stMetricValue"] {
-        color: #f0f6fc;
-        font-weight: 600;
-        text-shadow: none;
-    }
+def _init_session_state():
+    """Give every session-state key the app reads a default value."""
+    for key, default in (
+        ('analysis_results', None),
+        ('analysis_params', None),
+        ('analysis_id', None),
+        ('analysis_rows', None),
+        ('products_context_cached', None),
+        ('ai_analysis', None),
+        ('chat_messages', []),
+    ):
+        st.session_state.setdefault(key, default)
 
-    /* Sliders - Standard Blue/Grey Accent */
-    div[data-baseweb="slider"] {
-        padding-top: 1.5rem !important;
-    }
-    div[data-baseweb="slider"] div[role="slider"] {
-        background-color: #58a6ff !important;
-        box-shadow: none;
-    }
-    div[data-baseweb="slider"] div[data-testid="stTickBar"] div {
-        background-color: #30363d;
-    }
-    div[data-baseweb="slider"] div {
-        background-color: transparent !important;
-    }
-    div[data-baseweb="slider"] div[data-testid="stSliderTrack"] {
-        background-color: #30363d !important;
-    }
-    /* Value Labels */
-    .stSlider [data-testid="stMarkdownContainer"] p {
-        color: #c9d1d9 !important;
-        font-weight: 500 !important;
-        font-size: 1rem !important;
-        text-shadow: none;
-    }
 
-    /* Progress Bar */
-    .stProgress > div > div > div > div {
-        background: #58a6ff; /* Clean Blue */
-        box-shadow: none;
-    }
+# Per-session checkpoints so results and chat survive a server restart.
+# The ?sid= query parameter identifies the session across reloads.
+SESSION_DIR = os.path.join(os.path.dirname(__file__), '..', '.tmp', 'sessions')
+PERSISTED_STATE_KEYS = ('analysis_results', 'analysis_params', 'ai_analysis', 'chat_messages')
+SESSION_MAX_AGE_DAYS = 7  # checkpoints untouched for longer are deleted
 
-    /* Expanders */
-    .streamlit-expanderHeader {
-        background-color: #161b22;
-        border: 1px solid #30363d;
-        color: #c9d1d9;
-        border-radius: 6px;
-    }
-    .streamlit-expanderContent {
-        background-color: #0d1117;
-        border: 1px solid #30363d;
-        border-top: none;
-        border-radius: 0 0 6px 6px;
-    }
+
+def _session_path(sid: str) -> str:
+    return os.path.join(SESSION_DIR, f"{sid}.json")
+
+
+def prune_sessions():
+    """Delete session checkpoints not written for SESSION_MAX_AGE_DAYS."""
+    cutoff = time.time() - SESSION_MAX_AGE_DAYS * 86400
+    try:
+        names = os.listdir(SESSION_DIR)
+    except OSError:
+        return
+    for name in names:
+        path = os.path.join(SESSION_DIR, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            pass  # Removed by another session meanwhile
+
+
+def restore_session():
+    """Attach this browser session to a ?sid= checkpoint, loading it if one exists."""
+    if 'session_id' in st.session_state:
+        return
+    if not hasattr(st, 'query_params'):
+        return  # Streamlit < 1.30: no way to carry the sid, so no checkpoints
     
-    /* Tabs */
-    .stTabs [data-baseweb="tab-list"] {
-        gap: 20px;
-        border-bottom: 1px solid #30363d;
-    }
-    .stTabs [data-baseweb="tab"] {
-        color: #8b949e;
-        font-weight: 500;
-        background-color: transparent;
-        text-transform: none;
-        padding-bottom: 10px;
-    }
-    .stTabs [aria-selected="true"] {
-        color: #58a6ff !important;
-        border-bottom: 2px solid #58a6ff !important;
-        background-color: transparent !important;
-    }
+    prune_sessions()
+    sid = st.query_params.get('sid', '')
+    if not re.fullmatch(r'[0-9a-f]{32}', sid):
+        sid = uuid.uuid4().hex
+        st.query_params['sid'] = sid
+    st.session_state.session_id = sid
     
-    /* Links */
-    a {
-        color: #58a6ff !important;
-        text-decoration: none;
-        font-weight: 400;
-        text-shadow: none;
-    }
-    a:hover {
-        text-decoration: underline;
-        text-shadow: none;
-    }
-</style>
-""", unsafe_allow_html=True)
+    try:
+        with open(_session_path(sid), 'r', encoding='utf-8') as f:
+            saved = json.load(f)
+    except (OSError, ValueError):
+        return
+    
+    for key in PERSISTED_STATE_KEYS:
+        if saved.get(key) is not None:
+            st.session_state[key] = saved[key]
+    # Derive the display caches once here rather than on every rerun;
+    # the chat context is still built lazily on first use
+    results = st.session_state.analysis_results
+    try:
+        st.session_state.analysis_id = analysis_fingerprint(results) if results else None
+        st.session_state.analysis_rows = (
+            opportunities_to_csv_rows(results, as_columns=True) if results else None
+        )
+    except Exception as e:
+        # Unreadable results (e.g. saved by an older version): drop them, keep the sid
+        logger.warning("Discarding unusable results in session %s: %s", sid, e)
+        st.session_state.analysis_results = None
+        st.session_state.analysis_params = None
+        st.session_state.analysis_id = None
+        st.session_state.analysis_rows = None
+    st.session_state.products_context_cached = None
+
+
+def persist_session():
+    """Checkpoint the persisted session keys to .tmp/sessions/<sid>.json."""
+    sid = st.session_state.get('session_id')
+    if not sid:
+        return
+    
+    data = {key: st.session_state.get(key) for key in PERSISTED_STATE_KEYS}
+    try:
+        os.makedirs(SESSION_DIR, exist_ok=True)
+        # Temp file + rename so a restart mid-write never leaves a corrupt checkpoint
+        fd, tmp_path = tempfile.mkstemp(dir=SESSION_DIR, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, default=str)
+        os.replace(tmp_path, _session_path(sid))
+    except OSError as e:
+        logger.warning("Could not checkpoint session %s: %s", sid, e)
 
 
 def main():
+    st.markdown(load_css(), unsafe_allow_html=True)
+    
     st.title("🔍 Amazon Product Research")
     st.markdown("Find product opportunities across Amazon markets")
     
-    # Initialize session state for caching results
-    if 'analysis_results' not in st.session_state:
-        st.session_state.analysis_results = None
-    if 'analysis_params' not in st.session_state:
-        st.session_state.analysis_params = None
-    if 'ai_analysis' not in st.session_state:
-        st.session_state.ai_analysis = None
-    if 'analysis_params' not in st.session_state:
-        st.session_state.analysis_params = None
+    _init_session_state()
+    restore_session()
+    start_apify_prewarm()
     
     # Sidebar settings
     with st.sidebar:
@@ -248,67 +465,67 @@ def main():
         # Market selection
         st.subheader("🌍 Markets")
         
-        market_options = {
-            code: f"{info['flag']} {info['name']}" 
-            for code, info in MARKETS.items()
-        }
+        # Analysis controls are batched in a form so dragging a slider
+        # doesn't rerun the whole app until the user clicks Apply
+        with st.form("analysis_form"):
+            source_market = st.selectbox(
+                "Source Market (find products here)",
+                options=list(MARKET_OPTIONS_WITH_UNIV.keys()),
+                format_func=lambda x: MARKET_OPTIONS_WITH_UNIV[x],
+                index=1  # Default: Japan
+            )
         
-
+            target_market = st.selectbox(
+                "Target Market (sell products here)",
+                options=list(MARKET_OPTIONS.keys()),
+                format_func=lambda x: MARKET_OPTIONS[x],
+                index=0  # Default: USA
+            )
         
-        # Append Universal option if not in dict (it's a hack to show it in selectbox)
-        # Actually easier to just add it to options dict temporarily or handle in code
-        # Let's handle it by adding a literal option
+            st.divider()
         
-        market_options_with_univ = market_options.copy()
-        market_options_with_univ['universal'] = "🌐 Custom Site (AI Agent)"
+            # Parameters
+            st.subheader("📊 Parameters")
         
-        source_market = st.selectbox(
-            "Source Market (find products here)",
-            options=list(market_options_with_univ.keys()),
-            format_func=lambda x: market_options_with_univ[x],
-            index=1  # Default: Japan
-        )
+            max_results = st.slider(
+                "Scan Top N Products (List Only)",
+                min_value=5,
+                max_value=100,
+                value=10,
+                step=5,
+                help="How many items to scan from the bestseller list. Higher = more data but slower."
+            )
         
-        target_market = st.selectbox(
-            "Target Market (sell products here)",
-            options=list(market_options.keys()),
-            format_func=lambda x: market_options[x],
-            index=0  # Default: USA
-        )
+            min_reviews = st.slider(
+                "Min reviews (source market)",
+                min_value=100,
+                max_value=10000,
+                value=1000,
+                step=100
+            )
+        
+            include_subcategories = st.checkbox(
+                "Include subcategories",
+                value=False,
+                help="If checked, also scrapes products from subcategories (more results, but less precise)"
+            )
+            
+            cache_max_age_h = st.slider(
+                "Scrape cache max age (hours)",
+                min_value=1,
+                max_value=24,
+                value=SCRAPE_CACHE_TTL // 3600,
+                key="cache_max_age_h",
+                help="Bestseller lists scraped more recently than this are reused, even across app restarts."
+            )
+            
+            st.form_submit_button("Apply", use_container_width=True)
         
         if source_market == target_market:
             st.warning("⚠️ Source and target markets should be different")
         
         st.divider()
         
-        # Parameters
-        st.subheader("📊 Parameters")
-        
-        max_results = st.slider(
-            "Scan Top N Products (List Only)",
-            min_value=5,
-            max_value=100,
-            value=10,
-            step=5,
-            help="How many items to scan from the bestseller list. Higher = more data but slower."
-        )
-        
-        min_reviews = st.slider(
-            "Min reviews (source market)",
-            min_value=100,
-            max_value=10000,
-            value=1000,
-            step=100
-        )
-        
-        include_subcategories = st.checkbox(
-            "Include subcategories",
-            value=False,
-            help="If checked, also scrapes products from subcategories (more results, but less precise)"
-        )
-        
-        st.divider()
-        
         # API Status
         st.subheader("🔌 API Status")
         if st.button("Test Connection"):
@@ -333,7 +550,7 @@ def main():
         
         # Dynamic Header based on Source
         if source_market == 'universal':
-            st.markdown(f"Finding bestsellers on **AliExpress** to compare with **{market_options.get(target_market, target_market)}**")
+            st.markdown(f"Finding bestsellers on **AliExpress** to compare with **{MARKET_OPTIONS.get(target_market, target_market)}**")
             
             # Universal Source Inputs
             st.subheader("🌐 Universal Source Configuration")
@@ -355,48 +572,34 @@ def main():
             # Shared Category Selection
             st.subheader("📦 Select Categories (Source & Target)")
             
-            category_names = {
-                "home-garden": "🏠 Home & Kitchen",
-                "pet-supplies": "🐾 Pet Supplies",
-                "office-products": "📎 Office Products",
-                "sports-outdoors": "⚽ Sports & Outdoors",
-                "toys-games": "🎮 Toys & Games",
-                "adult": "🔞 Adult (18+)"
-            }
-            
-            cols = st.columns(3)
-            selected_categories = []
-            
-            for i, (cat_id, cat_name) in enumerate(category_names.items()):
-                with cols[i % 3]:
-                    if st.checkbox(cat_name, value=(i == 0), key=f"univ_cat_{cat_id}"):
-                        selected_categories.append(cat_id)
+            # One multiselect instead of a checkbox per category
+            selected_categories = st.multiselect(
+                "Categories",
+                options=list(CATEGORY_NAMES.keys()),
+                default=[next(iter(CATEGORY_NAMES))],
+                format_func=lambda x: CATEGORY_NAMES[x],
+                key="univ_categories",
+                label_visibility="collapsed"
+            )
 
             if not selected_categories:
                 st.warning("Please select at least one category.")
                 
         else:
-            st.markdown(f"Finding products popular in **{market_options.get(source_market, source_market)}** but not in **{market_options.get(target_market, target_market)}**")
+            st.markdown(f"Finding products popular in **{MARKET_OPTIONS.get(source_market, source_market)}** but not in **{MARKET_OPTIONS.get(target_market, target_market)}**")
             
             # Category selection (Only for Standard Markets)
             st.subheader("📦 Select Categories")
             
-            category_names = {
-                "home-garden": "🏠 Home & Kitchen",
-                "pet-supplies": "🐾 Pet Supplies",
-                "office-products": "📎 Office Products",
-                "sports-outdoors": "⚽ Sports & Outdoors",
-                "toys-games": "🎮 Toys & Games",
-                "adult": "🔞 Adult (18+)"
-            }
-            
-            cols = st.columns(3)
-            selected_categories = []
-            
-            for i, (cat_id, cat_name) in enumerate(category_names.items()):
-                with cols[i % 3]:
-                    if st.checkbox(cat_name, value=(i == 0), key=f"cat_{cat_id}"):
-                        selected_categories.append(cat_id)
+            # One multiselect instead of a checkbox per category
+            selected_categories = st.multiselect(
+                "Categories",
+                options=list(CATEGORY_NAMES.keys()),
+                default=[next(iter(CATEGORY_NAMES))],
+                format_func=lambda x: CATEGORY_NAMES[x],
+                key="categories",
+                label_visibility="collapsed"
+            )
             
             if not selected_categories:
                 st.warning("Please select at least one category")
@@ -431,181 +634,228 @@ def main():
                     categories=selected_categories,
                     max_results=max_results,
                     min_reviews=min_reviews,
-                    market_options=market_options,
                     subcategories=1 if include_subcategories else 0,
-                    universal_params=universal_params
+                    universal_params=universal_params,
+                    max_age=cache_max_age_h * 3600
                 )
+                if result is not None:
+                    # Fingerprint and flatten once; the fresh view below and the
+                    # cached view share them (and so the prepared DataFrame)
+                    analysis_id = analysis_fingerprint(result)
+                    analysis_rows = opportunities_to_csv_rows(result, as_columns=True)
+                    # A rendering error must not lose the scraped results stored below
+                    try:
+                        display_results(
+                            result, source_market, target_market, key_prefix="new_",
+                            analysis_id=analysis_id, rows=analysis_rows
+                        )
+                    except Exception as e:
+                        st.error(f"❌ Error during analysis: {e}")
+                
                 # Cache results in session
                 if result:
                     st.session_state.analysis_results = result
+                    st.session_state.analysis_id = analysis_id
+                    st.session_state.analysis_rows = analysis_rows
+                    # Built lazily by the chat so a plain run never imports openai
+                    st.session_state.products_context_cached = None
                     st.session_state.analysis_params = {
-                        'source': market_options.get(source_market, "🌐 Custom Site (AI Agent)"),
-                        'target': market_options.get(target_market, target_market),
+                        'source': MARKET_OPTIONS_WITH_UNIV[source_market],
+                        'target': MARKET_OPTIONS.get(target_market, target_market),
                         'source_code': source_market,
                         'target_code': target_market,
                         'time': datetime.now().strftime('%H:%M:%S')
                     }
+                    persist_session()
         
         # Show cached results if available (with unique key prefix)
         if st.session_state.analysis_results:
-            params = st.session_state.analysis_params
-            st.success(f"📊 Showing cached results from {params['time']} ({params['source']} → {params['target']})")
-            display_results(
-                st.session_state.analysis_results,
-                params.get('source_code', source_market),
-                params.get('target_code', target_market),
-                market_options,
-                key_prefix="cached_"
+            render_cached_results(source_market, target_market)
+    
+    with tab2:
+        render_product_search()
+
+
+@fragment
+def render_cached_results(source_market, target_market):
+    """Render stored results, AI analysis and chat; reruns on its own as a fragment."""
+    params = st.session_state.analysis_params
+    st.success(f"📊 Showing cached results from {params['time']} ({params['source']} → {params['target']})")
+    
+    # Clear cache buttons, ahead of the results so a checkpoint that fails to
+    # render can still be dropped
+    clear_col1, clear_col2 = st.columns(2)
+    with clear_col1:
+        if st.button("🗑️ Clear cached results", key="clear_cache_btn"):
+            st.session_state.analysis_results = None
+            st.session_state.analysis_params = None
+            st.session_state.analysis_id = None
+            st.session_state.analysis_rows = None
+            st.session_state.products_context_cached = None
+            st.session_state.ai_analysis = None
+            st.session_state.chat_messages = []
+            persist_session()
+            st.rerun()
+    with clear_col2:
+        # Drops the on-disk bestseller lists so the next run re-scrapes Amazon
+        if st.button("♻️ Clear scrape cache", key="clear_scrape_cache_btn"):
+            clear_scrape_cache()
+            st.toast("Scrape cache cleared")
+    
+    # Same guard as the fresh view, so a rendering error doesn't take down the
+    # AI analysis and chat below (or escape right after the fresh view caught it)
+    try:
+        display_results(
+            st.session_state.analysis_results,
+            params.get('source_code', source_market),
+            params.get('target_code', target_market),
+            key_prefix="cached_",
+            analysis_id=st.session_state.get('analysis_id'),
+            rows=st.session_state.get('analysis_rows')
+        )
+    except Exception as e:
+        st.error(f"❌ Error during analysis: {e}")
+    
+    # AI Analysis Section
+    st.divider()
+    st.subheader("🤖 AI Анализ продуктов")
+    st.markdown("Получите профессиональный анализ от AI: культурные различия, рекомендации по продажам, потенциальные риски.")
+    
+    col1, col2 = st.columns([1, 3])
+    with col1:
+        run_ai = st.button("🧠 Запустить AI анализ", type="primary", key="ai_analysis_btn")
+        split_ai = st.checkbox(
+            "Разбить на части",
+            key="ai_split",
+            help="Analyze large result sets in parallel chunks. Each chunk gets its own report."
+        )
+        chunk_size = None  # One request, one report
+        if split_ai:
+            chunk_size = st.slider(
+                "Продуктов на AI-запрос",
+                min_value=5,
+                max_value=50,
+                value=20,
+                step=5,
+                key="ai_chunk_size"
             )
-            
-            # AI Analysis Section
-            st.divider()
-            st.subheader("🤖 AI Анализ продуктов")
-            st.markdown("Получите профессиональный анализ от AI: культурные различия, рекомендации по продажам, потенциальные риски.")
-            
-            col1, col2 = st.columns([1, 3])
-            with col1:
-                if st.button("🧠 Запустить AI анализ", type="primary", key="ai_analysis_btn"):
-                    with st.spinner("🔄 AI анализирует продукты... (30-60 сек)"):
-                        try:
-                            # Get country names from market codes
-                            # Handle 'universal' (AliExpress) which is not in MARKETS
-                            if params['source_code'] == 'universal':
-                                source_country = "China (AliExpress)"
-                            else:
-                                source_country = MARKETS[params['source_code']]['name']
-                            target_country = MARKETS[params['target_code']]['name']
-                            
-                            ai_result = analyze_opportunities(
-                                opportunities=st.session_state.analysis_results,
-                                source_market=params['source_code'].upper(),
-                                target_market=params['target_code'].upper(),
-                                source_country=source_country,
-                                target_country=target_country
-                            )
-                            st.session_state.ai_analysis = ai_result
-                        except Exception as e:
-                            st.error(f"❌ Ошибка AI анализа: {e}")
-            
-            # Display AI analysis if available
-            if st.session_state.ai_analysis:
-                st.markdown("---")
-                st.markdown(st.session_state.ai_analysis)
-                
-                # === AI CHAT INTERFACE ===
-                st.markdown("---")
-                st.subheader("💬 Обсудить с AI")
-                st.markdown("Задайте вопросы о продуктах, попросите детали или обсудите стратегию")
-                
-                # Initialize chat history if not exists
-                if 'chat_messages' not in st.session_state:
-                    st.session_state.chat_messages = []
-                
-                # Display chat history
-                for message in st.session_state.chat_messages:
-                    with st.chat_message(message["role"]):
-                        st.markdown(message["content"])
-                
-                # Chat input
-                if user_message := st.chat_input("Напишите вопрос о продуктах..."):
-                    # Add user message to history
-                    st.session_state.chat_messages.append({"role": "user", "content": user_message})
+        if run_ai:
+            with st.spinner("🔄 AI анализирует продукты... (30-60 сек)"):
+                try:
+                    from ai_analyzer import analyze_opportunities
                     
-                    # Display user message
-                    with st.chat_message("user"):
-                        st.markdown(user_message)
+                    # Get country names from market codes
+                    # Handle 'universal' (AliExpress) which is not in MARKETS
+                    if params['source_code'] == 'universal':
+                        source_country = "China (AliExpress)"
+                    else:
+                        source_country = MARKETS[params['source_code']]['name']
+                    target_country = MARKETS[params['target_code']]['name']
                     
-                    # Generate AI response
-                    with st.chat_message("assistant"):
-                        with st.spinner("🤔 Думаю..."):
-                            try:
-                                from openai import OpenAI
-                                import os
-                                
-                                # Get API key
-                                api_key = None
-                                try:
-                                    if "OPENAI_API_KEY" in st.secrets:
-                                        api_key = st.secrets["OPENAI_API_KEY"]
-                                except:
-                                    pass
-                                if not api_key:
-                                    api_key = os.getenv("OPENAI_API_KEY")
-                                
-                                if not api_key:
-                                    st.error("OpenAI API key not found")
-                                else:
-                                    client = OpenAI(api_key=api_key)
-                                    
-                                    # Build context from analysis results
-                                    products_context = format_products_for_analysis(
-                                        st.session_state.analysis_results, 
-                                        params.get('source_code', 'source'), 
-                                        params.get('target_code', 'target')
-                                    )
-                                    
-                                    # Build messages for API
-                                    messages = [
-                                        {
-                                            "role": "system", 
-                                            "content": f"""Ты эксперт по Amazon FBA и арбитражу. 
-У тебя есть данные о продуктах и предыдущий анализ.
-
-КОНТЕКСТ ПРОДУКТОВ:
-{products_context[:3000]}
+                    ai_result = analyze_opportunities(
+                        opportunities=st.session_state.analysis_results,
+                        source_market=params['source_code'].upper(),
+                        target_market=params['target_code'].upper(),
+                        source_country=source_country,
+                        target_country=target_country,
+                        chunk_size=chunk_size
+                    )
+                    st.session_state.ai_analysis = ai_result
+                    persist_session()
+                except Exception as e:
+                    st.error(f"❌ Ошибка AI анализа: {e}")
+    
+    # Display AI analysis if available
+    if st.session_state.ai_analysis:
+        st.markdown("---")
+        st.markdown(st.session_state.ai_analysis)
+        
+        render_chat(params)
 
-ПРЕДЫДУЩИЙ АНАЛИЗ:
-{st.session_state.ai_analysis[:2000]}
 
-Отвечай на русском языке. Будь конкретным, ссылайся на реальные продукты из данных.
-Если спрашивают о конкретном продукте — дай детальный анализ с расчётами."""
-                                        }
-                                    ]
-                                    
-                                    # Add chat history
-                                    for msg in st.session_state.chat_messages[-10:]:  # Last 10 messages
-                                        messages.append({"role": msg["role"], "content": msg["content"]})
-                                    
-                                    response = client.chat.completions.create(
-                                        model="gpt-4o",
-                                        messages=messages,
-                                        temperature=0.7,
-                                        max_tokens=2000
-                                    )
-                                    
-                                    ai_response = response.choices[0].message.content
-                                    st.markdown(ai_response)
-                                    
-                                    # Add AI response to history
-                                    st.session_state.chat_messages.append({"role": "assistant", "content": ai_response})
-                                    
-                                    # Rerun to properly display conversation
-                                    st.rerun()
-                                    
-                            except Exception as e:
-                                st.error(f"Ошибка AI: {e}")
+# Nested fragment: sending a chat message reruns only this block, not the
+# results table and AI analysis around it
+@fragment
+def render_chat(params):
+    """AI chat about the cached analysis results."""
+    st.markdown("---")
+    st.subheader("💬 Обсудить с AI")
+    st.markdown("Задайте вопросы о продуктах, попросите детали или обсудите стратегию")
+    
+    # Display chat history
+    for message in st.session_state.chat_messages:
+        with st.chat_message(message["role"]):
+            st.markdown(message["content"])
+    
+    # Chat input
+    if user_message := st.chat_input("Напишите вопрос о продуктах..."):
+        # Add user message to history
+        st.session_state.chat_messages.append({"role": "user", "content": user_message})
+        
+        # Display user message
+        with st.chat_message("user"):
+            st.markdown(user_message)
+        
+        # Generate AI response
+        with st.chat_message("assistant"):
+            try:
+                client = get_openai_client()
                 
-                # Clear chat button
-                if st.session_state.chat_messages:
-                    if st.button("🗑️ Очистить чат", key="clear_chat_btn"):
-                        st.session_state.chat_messages = []
-                        st.rerun()
-            
-            st.divider()
-            
-            # Clear cache button
-            if st.button("🗑️ Clear cached results", key="clear_cache_btn"):
-                st.session_state.analysis_results = None
-                st.session_state.analysis_params = None
-                st.session_state.ai_analysis = None
-                st.session_state.chat_messages = []
-                st.rerun()
+                # Product context is built once when results are stored
+                products_context = st.session_state.get('products_context_cached')
+                if products_context is None:
+                    from ai_analyzer import format_products_for_analysis
+                    products_context = format_products_for_analysis(
+                        st.session_state.analysis_results,
+                        params.get('source_code', 'source'),
+                        params.get('target_code', 'target')
+                    )[:CHAT_CONTEXT_TOKENS * CHARS_PER_TOKEN]
+                    st.session_state.products_context_cached = products_context
+                
+                # Build messages for API: context shares a fixed budget, and the
+                # newest chat turns fill whatever the system prompt leaves
+                products_context, ai_analysis = fit_chat_context(
+                    products_context, st.session_state.ai_analysis
+                )
+                system_prompt = CHAT_SYSTEM_PROMPT.format(
+                    products_context=products_context,
+                    ai_analysis=ai_analysis
+                )
+                messages = [{"role": "system", "content": system_prompt}]
+                messages += trim_chat_history(
+                    st.session_state.chat_messages,
+                    CHAT_TOKEN_BUDGET - estimate_tokens(system_prompt)
+                )
+                
+                with st.spinner("🤔 Думаю..."):
+                    response = client.chat.completions.create(
+                        model="gpt-4o",
+                        messages=messages,
+                        temperature=0.7,
+                        max_tokens=2000,
+                        stream=True
+                    )
+                
+                # Render tokens as they arrive; returns the full reply text
+                ai_response = st.write_stream(chat_token_stream(response))
+                
+                # Add AI response to history
+                st.session_state.chat_messages.append({"role": "assistant", "content": ai_response})
+                persist_session()
+                    
+            except Exception as e:
+                st.error(f"Ошибка AI: {e}")
     
-    with tab2:
-        render_product_search(market_options)
+    # Clear chat button
+    if st.session_state.chat_messages:
+        if st.button("🗑️ Очистить чат", key="clear_chat_btn"):
+            st.session_state.chat_messages = []
+            persist_session()
+            st.rerun()
 
 
-def render_product_search(market_options):
+@fragment
+def render_product_search():
     """Render the Product Search tab."""
     st.header("🔍 Product Search")
     st.markdown("Search for a specific product across multiple Amazon markets")
@@ -620,19 +870,24 @@ def render_product_search(market_options):
     # Market selection for search
     st.subheader("🌍 Select markets to search")
     
-    search_markets = []
-    cols = st.columns(4)
-    for i, (code, info) in enumerate(MARKETS.items()):
-        with cols[i % 4]:
-            if st.checkbox(f"{info['flag']} {info['name']}", value=(code in ['us', 'jp']), key=f"search_market_{code}"):
-                search_markets.append(code)
+    search_markets = st.multiselect(
+        "Markets",
+        options=list(MARKET_OPTIONS.keys()),
+        default=['us', 'jp'],
+        format_func=lambda x: MARKET_OPTIONS[x],
+        key="search_markets",
+        label_visibility="collapsed"
+    )
     
     # Search button
     if st.button("🔎 Search", type="primary", disabled=not search_query or not search_markets, key="search_btn"):
-        search_product(search_query, search_markets, market_options)
+        search_product(
+            search_query, search_markets,
+            max_age=st.session_state.get('cache_max_age_h', SCRAPE_CACHE_TTL // 3600) * 3600
+        )
 
 
-def search_product(query, markets, market_options):
+def search_product(query, markets, max_age=SCRAPE_CACHE_TTL):
     """Search for a product across selected markets."""
     st.divider()
     
@@ -641,29 +896,50 @@ def search_product(query, markets, market_options):
     
     results = {}
     
-    for i, market in enumerate(markets):
-        status.text(f"🔄 Searching in {market_options[market]}...")
-        progress.progress((i + 1) / len(markets))
+    # For now, we'll use the bestsellers API and filter by name
+    # A proper implementation would use Amazon's search API
+    # Search in Home & Kitchen category as proxy
+    urls = {
+        market: CATEGORY_URLS.get('home-garden', {}).get(market)
+        for market in markets
+    }
+    
+    # Fetch all markets concurrently; each one is a blocking Apify run
+    fetched = {}
+    with st.spinner("⏳ Fetching bestseller lists..."):
+        executor = get_scrape_pool()
+        futures = {
+            executor.submit(cached_scrape_bestsellers, url, max_results=50, subcategories=1, max_age=max_age): market
+            for market, url in urls.items() if url
+        }
+        last_update = 0.0
+        for done, future in enumerate(as_completed(futures), 1):
+            market = futures[future]
+            # Throttle websocket updates; the final state is set after the loop
+            if time.monotonic() - last_update > PROGRESS_MIN_INTERVAL:
+                status.text(f"🔄 Searched {MARKET_OPTIONS[market]}...")
+                progress.progress(done / len(futures))
+                last_update = time.monotonic()
+            try:
+                fetched[market] = future.result()
+            except Exception as e:
+                fetched[market] = e
+    
+    # Filter in the user's market order once everything is back
+    for market in markets:
+        if market not in fetched:
+            continue
+        products = fetched[market]
+        if isinstance(products, Exception):
+            results[market] = {'products': [], 'error': str(products)}
+            continue
         
-        # For now, we'll use the bestsellers API and filter by name
-        # A proper implementation would use Amazon's search API
-        try:
-            # Search in Home & Kitchen category as proxy
-            url = CATEGORY_URLS.get('home-garden', {}).get(market)
-            if url:
-                products = cached_scrape_bestsellers(url, max_results=50, subcategories=1)
-                
-                # Filter products that match query
-                matching = [
-                    p for p in products 
-                    if query.lower() in p.get('name', '').lower()
-                ]
-                results[market] = {
-                    'products': matching[:10],
-                    'total_found': len(matching)
-                }
-        except Exception as e:
-            results[market] = {'products': [], 'error': str(e)}
+        # Filter products that match query (subcategory crawls repeat products)
+        matching = filter_by_name(dedupe_products(products), query)
+        results[market] = {
+            'products': matching[:10],
+            'total_found': len(matching)
+        }
     
     progress.progress(100)
     status.text("✅ Search complete!")
@@ -680,7 +956,7 @@ def search_product(query, markets, market_options):
     for market, data in results.items():
         products = data.get('products', [])
         
-        with st.expander(f"{market_options[market]} - {len(products)} found", expanded=len(products) > 0):
+        with st.expander(f"{MARKET_OPTIONS[market]} - {len(products)} found", expanded=len(products) > 0):
             if products:
                 for p in products:
                     col1, col2 = st.columns([4, 1])
@@ -698,7 +974,7 @@ def search_product(query, markets, market_options):
                 st.info("No matching products found")
 
 
-def run_analysis(source_market, target_market, categories, max_results, min_reviews, market_options, subcategories=0, universal_params=None):
+def run_analysis(source_market, target_market, categories, max_results, min_reviews, subcategories=0, universal_params=None, max_age=SCRAPE_CACHE_TTL):
     """Run the market comparison analysis. Returns opportunities dict."""
     
     progress_bar = st.progress(0)
@@ -706,88 +982,112 @@ def run_analysis(source_market, target_market, categories, max_results, min_revi
     
     try:
         # Step 1: Scrape source market
-        market_name = market_options.get(source_market, "Universal Source")
+        market_name = MARKET_OPTIONS.get(source_market, "Universal Source")
         status_text.text(f"🔄 Scraping {market_name}...")
         progress_bar.progress(10)
         
-        # DEBUG: Show values in UI to trace execution path
-        st.warning(f"🔧 DEBUG: source_market='{source_market}', universal_params={bool(universal_params)}, condition={source_market == 'universal' and bool(universal_params)}")
+        universal_source = source_market == 'universal' and bool(universal_params)
+        debug_note(
+            f"source_market='{source_market}', universal_params={bool(universal_params)}, "
+            f"universal_source={universal_source}",
+            st.warning
+        )
         
-        if source_market == 'universal' and universal_params:
-            st.success("✅ Entering UNIVERSAL branch (Firecrawl)")
+        if universal_source:
+            debug_note("Entering UNIVERSAL branch (Firecrawl)", st.success)
             # Universal Source Flow
-            # Lazy import to avoid circular dependency
-            from universal_adapter import UniversalAdapter
-            
-            # DEBUG: Show adapter initialization
-            st.info("🔧 DEBUG: Initializing UniversalAdapter...")
+            debug_note("Initializing UniversalAdapter...")
             try:
-                adapter = UniversalAdapter()
-                st.success("✅ UniversalAdapter initialized successfully")
+                adapter = universal_adapter.UniversalAdapter()
+                debug_note("UniversalAdapter initialized successfully", st.success)
             except Exception as init_error:
-                import traceback
                 st.error(f"❌ UniversalAdapter INIT FAILED: {init_error}")
-                st.code(traceback.format_exc())
+                debug_traceback("UniversalAdapter init failed")
                 raise init_error
             
-            source_data = {}
+            # Firecrawl runs get their own small pool (capped for its rate limits) so
+            # they overlap with the Amazon jobs below. Workers carry this run's script
+            # context so the adapter's st.* status messages still render.
+            script_ctx = get_script_run_ctx()
+            firecrawl_pool = ThreadPoolExecutor(
+                max_workers=min(6, len(categories)),
+                thread_name_prefix='firecrawl',
+                initializer=lambda: add_script_run_ctx(threading.current_thread(), script_ctx)
+            )
             
-            for i, category in enumerate(categories):
-                 status_text.text(f"🤖 Agent Scraping {category} from AliExpress...")
-                 
-                 # Determine URL
-                 if universal_params.get("use_manual_url") and universal_params.get("manual_url"):
-                     # Use the same manual URL for all categories (user override)
-                     target_url = universal_params["manual_url"]
-                 else:
-                     # Use mapping
-                     target_url = adapter.get_category_url(category)
-                 
-                 # DEBUG: Show URL being called
-                 st.info(f"🔗 DEBUG: Calling Firecrawl with URL: {target_url}")
-                 
-                 try:
-                     st.info("🔄 DEBUG: Starting scrape_products call...")
-                     products = adapter.scrape_products(
+            def scrape_universal(category):
+                # Determine URL
+                if universal_params.get("use_manual_url") and universal_params.get("manual_url"):
+                    # Use the same manual URL for all categories (user override)
+                    target_url = universal_params["manual_url"]
+                else:
+                    # Use mapping
+                    target_url = adapter.get_category_url(category)
+                
+                debug_note(f"Calling Firecrawl with URL: {target_url}")
+                
+                try:
+                    products = adapter.scrape_products(
                         url=target_url,
                         prompt=universal_params['prompt'],
                         limit=max_results
-                     )
-                     st.success(f"✅ Firecrawl returned {len(products)} products for {category}")
-                     
-                     # Extra debug: show first product if any
-                     if products:
-                         st.info(f"🔍 First product: {products[0].get('name', 'N/A')[:50]}")
-                 except Exception as fc_error:
-                     import traceback
-                     st.error(f"❌ Firecrawl FAILED: {fc_error}")
-                     st.code(traceback.format_exc())
-                     products = []
-                 
-                 source_data[category] = products
-                 progress_bar.progress(10 + int(30 * (i + 1) / len(categories)))
+                    )
+                    debug_note(f"Firecrawl returned {len(products)} products for {category}", st.success)
+                    if products:
+                        debug_note(f"First product: {products[0].get('name', 'N/A')[:50]}")
+                except Exception as fc_error:
+                    st.error(f"❌ Firecrawl FAILED: {fc_error}")
+                    debug_traceback(f"Firecrawl failed for {category}")
+                    products = []
+                
+                return products
+        
+        # Step 2: Scrape Amazon markets
+        # Source and target lists are independent I/O, so every (market, category)
+        # pair goes into one pool instead of two back-to-back loops.
+        # Resolve each market's URLs once up front; workers only see plain strings
+        tgt_urls = {category: CATEGORY_URLS[category][target_market] for category in categories}
+        jobs = [('tgt', category, url) for category, url in tgt_urls.items()]
+        if not universal_source:
+            src_urls = {category: CATEGORY_URLS[category][source_market] for category in categories}
+            jobs = [('src', category, url) for category, url in src_urls.items()] + jobs
+        
+        status_text.text(f"🔄 Scraping {len(jobs)} bestseller lists...")
+        
+        scraped = {}
+        with st.spinner("⏳ Waiting for bestseller lists..."):
+            futures = {}
+            if universal_source:
+                futures.update({
+                    firecrawl_pool.submit(scrape_universal, category): ('src', category)
+                    for category in categories
+                })
+                # Let queued Firecrawl jobs finish; the pool's threads exit afterwards
+                firecrawl_pool.shutdown(wait=False)
             
-        else:
-            # Standard Amazon Flow
-            source_data = {}
-            for i, category in enumerate(categories):
-                market_name = market_options.get(source_market, source_market)
-                status_text.text(f"🔄 Scraping {category} from {market_name}...")
-                url = CATEGORY_URLS[category][source_market]
-                products = cached_scrape_bestsellers(url, max_results=max_results, subcategories=subcategories)
-                source_data[category] = products
-                progress_bar.progress(10 + int(30 * (i + 1) / len(categories)))
-        
-        # Step 2: Scrape target market
-        status_text.text(f"🔄 Scraping {market_options[target_market]}...")
-        
-        target_data = {}
-        for i, category in enumerate(categories):
-            status_text.text(f"🔄 Scraping {category} from {market_options[target_market]}...")
-            url = CATEGORY_URLS[category][target_market]
-            products = cached_scrape_bestsellers(url, max_results=max_results, subcategories=subcategories)
-            target_data[category] = products
-            progress_bar.progress(40 + int(30 * (i + 1) / len(categories)))
+            executor = get_scrape_pool()
+            futures.update({
+                executor.submit(
+                    cached_scrape_bestsellers, url,
+                    max_results=max_results, subcategories=subcategories, max_age=max_age
+                ): (tag, category)
+                for tag, category, url in jobs
+            })
+            last_update = 0.0
+            for done, future in enumerate(as_completed(futures), 1):
+                tag, category = futures[future]
+                scraped[(tag, category)] = future.result()
+                
+                # Throttle websocket updates, but always show the last completion
+                if done == len(futures) or time.monotonic() - last_update > PROGRESS_MIN_INTERVAL:
+                    market_name = MARKET_OPTIONS.get(source_market if tag == 'src' else target_market, "AliExpress")
+                    status_text.text(f"✅ Scraped {category} from {market_name} ({done}/{len(futures)})")
+                    progress_bar.progress(10 + int(60 * done / len(futures)))
+                    last_update = time.monotonic()
+        
+        # Re-bucket in the user's category order
+        source_data = {category: scraped[('src', category)] for category in categories}
+        target_data = {category: scraped[('tgt', category)] for category in categories}
         
         # Step 3: Compare
         status_text.text("🔍 Analyzing opportunities...")
@@ -806,20 +1106,21 @@ def run_analysis(source_market, target_market, categories, max_results, min_revi
         progress_bar.progress(100)
         status_text.text("✅ Analysis complete!")
         
-        # Display results
-        display_results(opportunities, source_market, target_market, market_options, key_prefix="new_")
-        
-        return opportunities  # Return for caching
+        return opportunities  # Return for caching and display
         
     except Exception as e:
         st.error(f"❌ Error during analysis: {e}")
         return None
 
 
-def display_results(opportunities, source_market, target_market, market_options, key_prefix=""):
+def display_results(opportunities, source_market, target_market, key_prefix="", analysis_id=None, rows=None):
     """Display analysis results with unique key prefix to avoid duplicate element IDs."""
     
-    total_opps = sum(len(opps) for opps in opportunities.values())
+    # Stored results pass their pre-flattened columns; fresh ones are flattened here.
+    # Any column's length is the opportunity count, so reruns don't re-walk the dict.
+    if rows is None:
+        rows = opportunities_to_csv_rows(opportunities, as_columns=True)
+    total_opps = len(rows['category'])
     
     st.divider()
     st.header(f"🎯 Found {total_opps} Opportunities")
@@ -828,33 +1129,16 @@ def display_results(opportunities, source_market, target_market, market_options,
         st.info("No opportunities found with current settings. Try lowering the minimum reviews threshold.")
         return
     
-    # Convert to DataFrame for display
-    rows = opportunities_to_csv_rows(opportunities)
-    df = pd.DataFrame(rows)
-    
-    # Rename columns for display
-    df = df.rename(columns={
-        'category': 'Category',
-        'opportunity_score': 'Score',
-        'jp_name': 'Product Name',
-        'jp_reviews': 'Reviews',
-        'jp_stars': 'Rating',
-        'jp_price': 'Price',
-        'jp_url': 'URL',
-        'jp_thumbnail': 'Thumbnail',
-        'reason': 'Reason'
-    })
-    
-    # Sort by score
-    df = df.sort_values('Score', ascending=False).reset_index(drop=True)
+    if analysis_id is None:
+        analysis_id = analysis_fingerprint(opportunities)
     
-    # Display top opportunities
+    # Display top opportunities first; they don't wait on the DataFrame
     st.subheader("🏆 Top Opportunities")
     
-    for idx, row in df.head(5).iterrows():
-        product_name = row.get('Product Name', 'Unknown')[:60]
-        product_url = row.get('URL', '')
-        thumbnail_url = row.get('Thumbnail', '')
+    for idx, row in enumerate(top_picks(analysis_id, opportunities)):
+        product_name = (row['Product Name'] or 'Unknown')[:60]
+        product_url = row['URL']
+        thumbnail_url = row['Thumbnail']
         
         with st.expander(f"**[{row['Score']:.0f}]** {product_name}...", expanded=(idx == 0)):
             # Show thumbnail if available
@@ -862,14 +1146,18 @@ def display_results(opportunities, source_market, target_market, market_options,
             
             with img_col:
                 if thumbnail_url:
-                    st.image(thumbnail_url, width=120)
+                    # loading="lazy": the browser fetches images only when scrolled into view
+                    st.markdown(
+                        f'<img src="{html.escape(thumbnail_url)}" width="120" loading="lazy">',
+                        unsafe_allow_html=True
+                    )
                 else:
                     st.write("📷 No image")
             
             with info_col:
                 col1, col2, col3 = st.columns(3)
                 with col1:
-                    st.metric("Reviews", f"{row['Reviews']:,}")
+                    st.metric("Reviews", f"{int(row['Reviews'] or 0):,}")
                 with col2:
                     st.metric("Rating", f"⭐ {row['Rating']}")
                 with col3:
@@ -884,13 +1172,34 @@ def display_results(opportunities, source_market, target_market, market_options,
     # Full table with clickable links
     st.subheader("📋 All Results")
     
+    # Convert to DataFrame for display (cached per result set)
+    with st.spinner("Building full table..."):
+        df = prepare_display(analysis_id, rows)
+    
+    render_results_table(df, rows, analysis_id, source_market, target_market, key_prefix)
+
+
+def render_results_table(df, rows, analysis_id, source_market, target_market, key_prefix=""):
+    """Render a prepared results DataFrame and its CSV download (UI only, no data prep)."""
     # Select columns to display
     display_cols = ['Score', 'Category', 'Product Name', 'Reviews', 'Rating', 'Price', 'URL']
     display_cols = [c for c in display_cols if c in df.columns]
     
+    # Only the top rows go over the websocket; the CSV below keeps the full set
+    rows_to_show = st.number_input(
+        "Rows to show",
+        min_value=10,
+        value=MAX_TABLE_ROWS,
+        step=50,
+        key=f"{key_prefix}rows_to_show"
+    )
+    display_df = df.head(int(rows_to_show))[display_cols]
+    if len(df) > rows_to_show:
+        st.caption(f"Showing top {rows_to_show} of {len(df)} rows — download CSV for full set")
+    
     # Configure dataframe with clickable URL column
     st.dataframe(
-        df[display_cols],
+        display_df,
         use_container_width=True,
         column_config={
             "URL": st.column_config.LinkColumn(
@@ -903,8 +1212,11 @@ def display_results(opportunities, source_market, target_market, market_options,
         }
     )
     
-    # Download button
-    csv = df.to_csv(index=False)
+    # Download button; with deferred downloads the CSV is only built when clicked
+    if DEFERRED_DOWNLOADS:
+        csv = lambda: results_csv(analysis_id, rows)
+    else:
+        csv = results_csv(analysis_id, rows)
     st.download_button(
         label="📥 Download CSV",
         data=csv,